@@ -1,5 +1,5 @@
 import enum
-import string
+import re
 from collections import deque
 from parser import Grammar, Parser, Rule, Symbol
 from typing import List
@@ -14,6 +14,8 @@ class TokenType(enum.Enum):
 
 
 class Token(object):
+    __slots__ = ("value", "type")
+
     def __init__(self, value, type):
         self.value = value
         self.type = type
@@ -25,48 +27,39 @@ class Token(object):
         return "Token(%r, %s)" % (self.value, self.type)
 
 
+# Leading whitespace is skipped as part of each match
+TOKEN_RE = re.compile(r"""[ \t]*(?:
+    (?P<COMMENT>\#[^\n]*\n?)
+  | (?P<STRING>'[^']*'|"[^"]*")
+  | (?P<IDENTIFIER>[A-Za-z0-9_]+)
+  | (?P<OPERATOR>[()\[\]|*+:])
+  | (?P<NEWLINE>\n)
+  | (?P<UNKNOWN>[^ \t])
+)""", re.VERBOSE)
+
+
 def tokenize(input):
-    idx = 0
-    end = len(input)
-    id_chars = set(string.ascii_letters + string.digits + "_")
-    op_chars = set("()[]|*+:")
     nesting_level = 0
 
-    while idx < end:
-        c = input[idx]
-        if c == "#":
-            while input[idx] != "\n" and idx < end:
-                idx += 1
-            if input[idx] == "\n":
-                idx += 1
-        elif c == "'" or c == "\"":
-            idx2 = idx + 1
-            while idx2 < end and input[idx2] != c:
-                idx2 += 1
-            yield Token(input[idx + 1:idx2], TokenType.STRING)
-            idx = idx2 + 1
-        elif c == " ":
-            idx += 1
-            continue
-        elif c in id_chars:
-            idx2 = idx + 1
-            while idx2 < end and input[idx2] in id_chars:
-                idx2 += 1
-            yield Token(input[idx:idx2], TokenType.IDENTIFIER)
-            idx = idx2
-        elif c in op_chars:
-            if c in "([":
+    for match in TOKEN_RE.finditer(input):
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "IDENTIFIER":
+            yield Token(value, TokenType.IDENTIFIER)
+        elif kind == "OPERATOR":
+            if value in "([":
                 nesting_level += 1
-            elif c in ")]":
+            elif value in ")]":
                 nesting_level -= 1
-            yield Token(c, TokenType.OPERATOR)
-            idx += 1
-        elif c == "\n":
+            yield Token(value, TokenType.OPERATOR)
+        elif kind == "STRING":
+            yield Token(value[1:-1], TokenType.STRING)
+        elif kind == "NEWLINE":
             if nesting_level == 0:
-                yield Token(c, TokenType.NEWLINE)
-            idx += 1
-        else:
-            assert False, "Unknown character %s(%d)" % (c, idx)
+                yield Token(value, TokenType.NEWLINE)
+        elif kind == "UNKNOWN":
+            assert False, "Unknown character %s(%d)" % (
+                value, match.start(kind))
 
     yield Token("", TokenType.ENDMARKER)
 
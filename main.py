@@ -1,6 +1,9 @@
-from io import BytesIO
+from io import BytesIO, TextIOWrapper
 from parser import Parser, Symbol
 from grammar_parser import GrammarParser
+import hashlib
+import os
+import pickle
 import sys
 import tokenize
 
@@ -13,12 +16,24 @@ TOKEN_MAP = {
 
 
 class Terminal(object):
-    def __init__(self, value):
-        self.is_token_type = False
-        if value.isupper():
-            self.is_token_type = True
-            self.token_type = TOKEN_MAP[value]
-        self.value = value
+    __slots__ = ("is_token_type", "token_type", "value")
+    # Terminals are interned by value, so equal terminals are one object
+    _cache = {}
+
+    def __new__(cls, value):
+        terminal = cls._cache.get(value)
+        if terminal is None:
+            terminal = super().__new__(cls)
+            terminal.is_token_type = False
+            if value.isupper():
+                terminal.is_token_type = True
+                terminal.token_type = TOKEN_MAP[value]
+            terminal.value = value
+            cls._cache[value] = terminal
+        return terminal
+
+    def __getnewargs__(self):
+        return (self.value,)
 
     def match(self, token):
         if self.is_token_type:
@@ -29,19 +44,57 @@ class Terminal(object):
         return self.value
 
 
+def load_grammar(path):
+    """Parse the grammar at path, reusing a pickled copy if it is current"""
+    # Key the cache on the code that builds the grammar too, so editing it
+    # invalidates stale pickles. The pickle refers to Terminal by module name,
+    # which is __main__ when this file runs as a script, so that is part of
+    # the key as well.
+    with open(path, "rb") as file:
+        source = file.read()
+    digest = hashlib.blake2b(source)
+    digest.update(Terminal.__module__.encode())
+    for cls in (Terminal, Parser, GrammarParser):
+        with open(sys.modules[cls.__module__].__file__, "rb") as file:
+            digest.update(file.read())
+    digest = digest.digest()
+
+    cache_path = path + ".cache.pkl"
+    try:
+        with open(cache_path, "rb") as file:
+            if file.read(len(digest)) == digest:
+                return pickle.load(file)
+    except Exception:
+        # A missing or unreadable cache just means building the grammar
+        pass
+
+    # Decode as UTF-8 with universal newlines, so CRLF checkouts still parse
+    text = TextIOWrapper(BytesIO(source), encoding="utf-8").read()
+    grammar = GrammarParser(Terminal).parse(text)
+    # Write to a temporary file first so a failed dump never leaves a
+    # truncated cache behind
+    tmp_path = cache_path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as file:
+            file.write(digest)
+            pickle.dump(grammar, file, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+    return grammar
+
+
 def main():
-    grammar = open("Grammar.txt").read()
-    gp = GrammarParser(Terminal)
-    grammar = gp.parse(grammar)
+    grammar = load_grammar("Grammar.txt")
     parser = Parser(grammar)
 
     file = open(sys.argv[1], "rb")
-    tokens = []
-    for token in tokenize.tokenize(file.readline):
-        if token.type in (tokenize.ENCODING, tokenize.COMMENT, tokenize.NL):
-            continue
-        tokens.append(token)
+    skipped = (tokenize.ENCODING, tokenize.COMMENT, tokenize.NL)
+    tokens = (
+        token for token in tokenize.tokenize(file.readline)
+        if token.type not in skipped)
     parser.parse(tokens)
 
 
-main()
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,65 @@
-from collections import namedtuple
+from collections import defaultdict, namedtuple
+from itertools import islice
 
 # token = string or Token
 Symbol = namedtuple("Symbol", ["token", "is_terminal"])
 
-# expansion = [Symbol]
-Rule = namedtuple("Rule", ['symbol', 'expansion'])
+
+class Rule(object):
+    # expansion = [Symbol]
+    # null_advance[pos] = number of consecutive nullable symbols from pos
+    # first_mask = Grammar.terminal_bits of the terminals the rule can start
+    # with, or -1 if the whole expansion is nullable
+    __slots__ = (
+        "symbol", "expansion", "exp_len", "null_advance", "first_mask")
+
+    def __init__(self, symbol, expansion):
+        self.symbol = symbol
+        self.expansion = expansion
+        self.exp_len = len(expansion)
+
+    def __repr__(self):
+        return "Rule(%r, %r)" % (self.symbol, self.expansion)
+
+
+# Set to True to trace the parse; call sites in the parse loop check it
+# before building their arguments
+DEBUG = False
 
 
 def log(*args):
-    # print(*args)
-    pass
+    if DEBUG:
+        print(*args)
 
 
 class Grammar(object):
     def __init__(self, rules, start):
         self.validate(rules)
-        self.rules = rules
-        self.start = start
+        # Canonical instance of every symbol, so they can be compared by id
+        self.symbols = {}
+        self.rules = [
+            Rule(self._intern(rule.symbol),
+                 [self._intern(symbol) for symbol in rule.expansion])
+            for rule in rules]
+        self.start = self._intern(start)
+        self.rules_by_lhs = {}
+        for rule in self.rules:
+            self.rules_by_lhs.setdefault(rule.symbol, []).append(rule)
         self.nullable = set()
         self._find_nullables()
+        for rule in self.rules:
+            rule.null_advance = [0] * (rule.exp_len + 1)
+            for pos in range(rule.exp_len - 1, -1, -1):
+                if rule.expansion[pos] in self.nullable:
+                    rule.null_advance[pos] = rule.null_advance[pos + 1] + 1
+        # Bit 0 is set in every match_mask, so that nullable rules always
+        # pass the prediction filter
+        self.terminal_bits = {}
+        for symbol in self.symbols.values():
+            if symbol.is_terminal:
+                self.terminal_bits[symbol.token] = (
+                    1 << (len(self.terminal_bits) + 1))
+        self._find_first_sets()
 
     def validate(self, rules):
         non_terminals = set()
@@ -37,159 +78,275 @@ class Grammar(object):
             ", ".join(s.token for s in missing_expansions)
         )
 
+    def _intern(self, symbol):
+        return self.symbols.setdefault(
+            (symbol.token, symbol.is_terminal), symbol)
+
+    def lookup(self, symbol):
+        """Get the canonical instance of symbol, or symbol if it is unknown"""
+        return self.symbols.get((symbol.token, symbol.is_terminal), symbol)
+
     def _find_nullables(self):
+        # rules_by_rhs[symbol] = rules with symbol in their expansion, once per
+        # occurrence
+        rules_by_rhs = defaultdict(list)
+        # remaining[rule] = number of symbols in the expansion not yet known
+        # to be nullable
+        remaining = {}
+        worklist = []
+        for rule in self.rules:
+            remaining[rule] = rule.exp_len
+            for symbol in rule.expansion:
+                if not symbol.is_terminal:
+                    rules_by_rhs[symbol].append(rule)
+            if rule.exp_len == 0:
+                worklist.append(rule.symbol)
+
+        while worklist:
+            symbol = worklist.pop()
+            if symbol in self.nullable:
+                continue
+            self.nullable.add(symbol)
+            for rule in rules_by_rhs[symbol]:
+                remaining[rule] -= 1
+                if remaining[rule] == 0:
+                    worklist.append(rule.symbol)
+
+    def _find_first_sets(self):
+        # first[symbol] = terminal_bits of the terminals symbol can start with
+        first = {}
+        for symbol in self.symbols.values():
+            if symbol.is_terminal:
+                first[symbol] = self.terminal_bits[symbol.token]
+            else:
+                first[symbol] = 0
+
+        def rule_first(rule):
+            mask = 0
+            for symbol in rule.expansion[:rule.null_advance[0] + 1]:
+                mask |= first[symbol]
+            return mask
+
         while True:
             changed = False
             for rule in self.rules:
-                if rule.symbol in self.nullable:
-                    continue
-                if all(symbol in self.nullable for symbol in rule.expansion):
-                    self.nullable.add(rule.symbol)
+                mask = first[rule.symbol] | rule_first(rule)
+                if mask != first[rule.symbol]:
+                    first[rule.symbol] = mask
                     changed = True
             if not changed:
                 break
 
+        for rule in self.rules:
+            if rule.null_advance[0] == rule.exp_len:
+                rule.first_mask = -1
+            else:
+                rule.first_mask = rule_first(rule)
 
-class Item(object):
-    def __init__(self, rule, start, position=0):
-        self.rule = rule
-        self.start = start
-        self.position = position
-
-    def __eq__(self, other):
-        return (self.rule == other.rule and
-            self.start == other.start and
-            self.position == other.position)
-
-    def __hash__(self):
-        h = hash(self.rule.symbol) ^ hash(self.start) ^ hash(self.position)
-        for s in self.rule.expansion:
-            h ^= hash(s)
-        return h
+    def match_mask(self, token):
+        """Get the terminal_bits of every terminal that matches token"""
+        mask = 1
+        for terminal, bit in self.terminal_bits.items():
+            if terminal.match(token):
+                mask |= bit
+        return mask
 
-    def is_partial_parse(self):
-        return self.position == len(self.rule.expansion) and self.start == 0
 
-    def is_full_parse(self, start):
-        return self.is_partial_parse() and self.rule.symbol == start
+# item = (rule, start, position)
+def is_full_parse(item, start):
+    rule, item_start, position = item
+    return (position == rule.exp_len and item_start == 0 and
+        rule.symbol is start)
 
-    def can_match(self, symbol):
-        return (self.position < len(self.rule.expansion) and
-            self.rule.expansion[self.position] == symbol)
 
-    def __str__(self):
-        s = ""
-        s += self.rule.symbol.token + " ->"
-        for symbol in self.rule.expansion[:self.position]:
-            s += " %s" % symbol.token
-        s += " •"
-        for symbol in self.rule.expansion[self.position:]:
-            s += " %s" % symbol.token
-        s += " (%d)" % self.start
-        return s
+def item_to_str(item):
+    rule, start, position = item
+    s = ""
+    s += rule.symbol.token + " ->"
+    for symbol in rule.expansion[:position]:
+        s += " %s" % symbol.token
+    s += " •"
+    for symbol in rule.expansion[position:]:
+        s += " %s" % symbol.token
+    s += " (%d)" % start
+    return s
 
 
 class Parser(object):
-    def __init__(self, grammar):
+    def __init__(self, grammar, memoize=False):
         self.grammar = grammar
-        self.predictions = {}
-        self.advancing_items = {}
-
-    def parse(self, input, start_symbol=None):
+        # _memo[(start_symbol, start_pos)] = spans returned by parse for
+        # _memo_input; parsing any other input object clears it
+        self.memoize = memoize
+        self._memo = {}
+        self._memo_input = None
+
+    def parse(self, input, start_symbol=None, start_pos=0):
+        """Parse input from start_pos, returning where start_symbol ends"""
         if start_symbol is None:
             start_symbol = self.grammar.start
-        self.states = [[] for _ in range(len(input) + 1)]
+        else:
+            start_symbol = self.grammar.lookup(start_symbol)
+        self.states = []
+        # waiting[idx][id(symbol)] = items in state idx waiting on symbol
+        self.waiting = []
+        # Items are only ever added to the current or the next state, so the
+        # dedup keys and the scannable[idx][terminal] buckets are dropped once
+        # the state has been scanned
+        self.state_keys = []
+        self.scannable = []
+
+        # A memo hit leaves the chart empty, since nothing was parsed
+        key = (start_symbol, start_pos)
+        if self.memoize:
+            if input is not self._memo_input:
+                self._memo = {}
+                self._memo_input = input
+            if key in self._memo:
+                return self._memo[key]
+
+        # input may be any iterable of tokens; it is consumed one token per
+        # state, and the chart grows as tokens are scanned
+        tokens = islice(input, start_pos, None)
+        # spans = positions in input where a parse of start_symbol ends
+        spans = []
+        self.add_state()
 
         # Intiialize S(0)
-        for rule in self.grammar.rules:
-            if rule.symbol == start_symbol:
-                self.states[0].append(Item(rule, 0))
+        for rule in self.grammar.rules_by_lhs.get(start_symbol, ()):
+            self.add_item(0, (rule, 0, 0))
 
+        add_item = self.add_item
+        get_advancing_items = self.get_advancing_items
+        get_predictions = self.get_predictions
+        terminal_bits = self.grammar.terminal_bits
         for idx, state in enumerate(self.states):
-            log("=" * 10)
-            if idx < len(input):
-                token = input[idx]
+            token = next(tokens, None)
+            if token is not None:
+                self.add_state()
+                token_mask = self.grammar.match_mask(token)
             else:
-                token = None
-            log("Parsing", token)
-            log("=" * 10)
-            seen = set()
-            seen_next = set()
-            for item in state:
-                # log(item)
+                token_mask = -1
+            if DEBUG:
+                log("=" * 10)
+                log("Parsing", token)
+                log("=" * 10)
+            # ids of the symbols already predicted in this state
+            predicted = set()
+            i = 0
+            while i < len(state):
+                item = state[i]
+                i += 1
+                rule, start, position = item
+                # log(item_to_str(item))
                 # Completion
-                if item.position == len(item.rule.expansion):
-                    # log(item)
+                if position == rule.exp_len:
+                    if (start == 0 and rule.symbol is start_symbol and
+                            (not spans or spans[-1] != start_pos + idx)):
+                        spans.append(start_pos + idx)
+                    # log(item_to_str(item))
                     # log("  Completions:",)
-                    for completing_item in self.get_advancing_items(
-                            item.rule.symbol, item.start):
-                        # log("   ", completing_item)
-                        self.add_item(state, seen, Item(
-                            completing_item.rule,
-                            completing_item.start,
-                            completing_item.position + 1))
+                    for (completing_rule, completing_start,
+                            completing_position) in get_advancing_items(
+                                rule.symbol, start):
+                        # log("   ", item_to_str((completing_rule,
+                        #     completing_start, completing_position)))
+                        add_item(idx, (
+                            completing_rule,
+                            completing_start,
+                            completing_position + 1))
                 else:
-                    symbol = item.rule.expansion[item.position]
-                    # Scan
-                    if symbol.is_terminal:
-                        if token is not None and symbol.token.match(token):
-                            log(item)
-                            log("  Scanned successfully", token)
-                            self.add_item(self.states[idx + 1], seen_next,
-                                Item(item.rule, item.start, item.position + 1))
-                    else:
-                        # Prediction
-                        for rule in self.get_predictions(symbol):
-                            # log("  Predicted:", rule.symbol.token, "->",
-                            #     [s.token for s in rule.expansion])
-                            self.add_item(state, seen, Item(rule, idx))
-                        # Completion for nullable symbols
-                        if symbol in self.grammar.nullable:
-                            self.add_item(state, seen, Item(
-                                item.rule, item.start, item.position + 1))
+                    symbol = rule.expansion[position]
+                    # Terminals are scanned once the state is complete
+                    if not symbol.is_terminal:
+                        # Prediction, skipping rules that cannot start with
+                        # the token. It only depends on the symbol and the
+                        # state, so items waiting on the same symbol share it.
+                        if id(symbol) not in predicted:
+                            predicted.add(id(symbol))
+                            for predicted_rule in get_predictions(symbol):
+                                if not predicted_rule.first_mask & token_mask:
+                                    continue
+                                # log("  Predicted:",
+                                #     predicted_rule.symbol.token, "->",
+                                #     [s.token for s in
+                                #      predicted_rule.expansion])
+                                add_item(idx, (predicted_rule, idx, 0))
+                        # Completion for nullable symbols, advancing over the
+                        # whole run of nullable symbols at once
+                        null_advance = rule.null_advance[position]
+                        if null_advance:
+                            for null_position in range(position + 1,
+                                    position + 1 + null_advance):
+                                add_item(idx, (rule, start, null_position))
+
+            # Scan, using the terminals already matched against the token
+            if token is not None:
+                for terminal, items in self.scannable[idx].items():
+                    if terminal_bits[terminal] & token_mask:
+                        if DEBUG:
+                            log("  Scanned successfully", terminal, token)
+                        for rule, start, position in items:
+                            add_item(idx + 1, (rule, start, position + 1))
+            self.state_keys[idx] = None
+            self.scannable[idx] = None
+            # Stop reading input once no item can continue past this token
+            if token is not None and not self.states[idx + 1]:
+                break
 
         # log("=" * 10)
         # log("Finished parsing")
         is_fully_parsed = False
         for item in self.states[-1]:
-            if item.is_full_parse(start_symbol):
-                print("Fully parsed:", item)
+            if is_full_parse(item, start_symbol):
+                print("Fully parsed:", item_to_str(item))
                 is_fully_parsed = True
 
         if not is_fully_parsed:
             print("Partial parse")
-            for state in self.states[::-1]:
+            # Report the longest partial parses only
+            for state in reversed(self.states):
+                found = False
                 for item in state:
-                    if item.is_full_parse(start_symbol):
-                        print("Partial parse:", item)
+                    if is_full_parse(item, start_symbol):
+                        print("Partial parse:", item_to_str(item))
+                        found = True
+                if found:
+                    break
+
+        spans = tuple(spans)
+        if self.memoize:
+            self._memo[key] = spans
+        return spans
+
+    def add_state(self):
+        self.states.append([])
+        self.waiting.append(defaultdict(list))
+        self.state_keys.append(set())
+        self.scannable.append(defaultdict(list))
 
     def get_advancing_items(self, symbol, idx):
         """Find any items in state that can match symbol"""
-        key = (idx, symbol)
-        if key not in self.advancing_items:
-            state = self.states[idx]
-            items = []
-            for item in state:
-                if item.can_match(symbol):
-                    items.append(item)
-            self.advancing_items[key] = items
-        return self.advancing_items[key]
+        return self.waiting[idx].get(id(symbol), ())
 
     def get_predictions(self, symbol):
         """Get all rules that expand symbol"""
-        if symbol not in self.predictions:
-            predictions = []
-            for rule in self.grammar.rules:
-                if rule.symbol == symbol:
-                    predictions.append(rule)
-            self.predictions[symbol] = predictions
-        return self.predictions[symbol]
-
-    def add_item(self, state, seen, new_item):
-        # TODO: use sets for states
-        if new_item not in seen:
-            state.append(new_item)
-            seen.add(new_item)
+        return self.grammar.rules_by_lhs.get(symbol, ())
+
+    def add_item(self, state_idx, new_item):
+        """Add new_item to the state unless an identical item is present"""
+        keys = self.state_keys[state_idx]
+        if new_item in keys:
+            return
+        keys.add(new_item)
+        self.states[state_idx].append(new_item)
+        rule, start, position = new_item
+        if position < rule.exp_len:
+            symbol = rule.expansion[position]
+            if symbol.is_terminal:
+                self.scannable[state_idx][symbol.token].append(new_item)
+            else:
+                self.waiting[state_idx][id(symbol)].append(new_item)
 
     def __str__(self):
         s = []
@@ -198,16 +355,18 @@ class Parser(object):
             s.append("  State %d" % i)
             s.append("-" * 10)
             for item in state:
-                s.append("    " + str(item))
+                s.append("    " + item_to_str(item))
         return "\n".join(s)
 
 
 class Token(object):
-    def __init__(self, range):
-        self.range = set(range)
+    __slots__ = ("range", "match")
 
-    def match(self, symbol):
-        return symbol in self.range
+    def __init__(self, range):
+        self.range = frozenset(range)
+        # match(symbol) is the set's own membership test, which saves a
+        # Python-level call per scan
+        self.match = self.range.__contains__
 
     def __str__(self):
         if len(self.range) > 2:
@@ -252,3 +411,7 @@ def test():
     parser = Parser(grammar)
     parser.parse(input)
     # log(parser)
+
+
+if __name__ == "__main__":
+    test()